@@ -0,0 +1,98 @@
+# -*- encoding: utf-8 -*-
+
+"""
+Bounded caches used by the client to avoid repeating lookups on odoo
+
+.. code:: python
+
+    cache = LRUCache(maxsize=2)
+    cache['20'] = tax
+    cache.get('20')
+    cache.cache_info()
+"""
+
+import collections
+import threading
+
+__all__ = ['LRUCache', 'CacheInfo']
+
+CacheInfo = collections.namedtuple('CacheInfo',
+                                   ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    '''
+    Mapping that keeps at most ``maxsize`` keys, evicting the least recently
+    used one first, and counts hits and misses
+    '''
+    def __init__(self, maxsize=256, name=None):
+        '''
+        Create an empty cache, ``name`` identify it in persistent storage.
+        '''
+        self.maxsize = maxsize
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        '''
+        Return value for ``key`` and mark it as recently used, ``default``
+        if missing. Lookups are counted in :py:meth:`cache_info`.
+        '''
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data.pop(key)
+            self._data[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def pop(self, key, default=None):
+        '''
+        Remove ``key`` and return its value, ``default`` if missing.
+        '''
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        '''
+        Remove all keys, statistics are kept.
+        '''
+        with self._lock:
+            self._data.clear()
+
+    def cache_info(self):
+        '''
+        Return hits, misses, maxsize and currsize like functools.lru_cache.
+        '''
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize,
+                             len(self._data))
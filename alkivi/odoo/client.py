@@ -3,32 +3,84 @@ OpenERP wrapper that use clientlib
 """
 
 import io
+import json
 import odoorpc
 import logging
-import re
+import os
+import threading
+import time
 import uuid
 
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import anydbm as dbm
+except ImportError:  # pragma: no cover
+    # Python 3
+    import dbm
+
 import email.generator
 import email.mime.multipart
 import email.message
 
+from .cache import LRUCache
 from .config import config
+from .transport import build_opener
 
 TAX_DIFFERENCE_WARNING = 0.80
 
+CACHE_SIZE = 256
+
+# Bump this ir.config_parameter to invalidate products and taxes caches
+CACHE_REVISION_PARAM = 'alkivi.cache_rev'
+CACHE_REVISION_TTL = 60
+
+# Past soft ttl cached value is returned and refreshed in background,
+# past hard ttl it is fetched again before returning
+CACHE_SOFT_TTL = 300
+CACHE_HARD_TTL = 3600
+
+# Products and taxes caches are also kept on disk between runs
+CACHE_FILE = os.path.expanduser('~/.cache/alkivi-odoo/cache')
+
+TAX_FIELDS = ['id', 'amount', 'tax_code_id', 'description']
+PRODUCT_FIELDS = ['id', 'name_template']
+ACCOUNT_FIELDS = ['id', 'code', 'name']
+
+# Partners fetched at once when looking for exact and similar names
+PARTNER_SEARCH_LIMIT = 20
+
+
+class Record(dict):
+    """Lightweight record built from read / search_read data.
+
+    Fields are available as attributes (record.id, record.amount ...) like
+    on a browse record, but no lazy RPC is ever triggered.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
 
 class Client(object):
     """Simple wrapper that use clientlib."""
 
     def __init__(self, endpoint=None, protocol=None, port=None, url=None,
                  version=None, db=None, user=None, password=None,
-                 config_file=None, logger=None):
+                 config_file=None, logger=None, cache_size=CACHE_SIZE,
+                 cache_file=None):
         """
         Creates a new Client.
 
         If any of ``endpoint``, ``protocol``, ``port``
         or ``url`` is not provided, this client will attempt to locate
         from them from environment, ~/.odoo.cfg or /etc/odoo.cfg.
+
+        ``cache_file`` is where products and taxes are persisted, False
+        disable it.
         """
         # Create logger
         if logger:
@@ -44,55 +96,294 @@ class Client(object):
         if endpoint is None:
             endpoint = config.get('default', 'endpoint')
 
-        # load data
+        # load data, whole endpoint section is read once
+        section = config.items(endpoint)
+
         if protocol is None:
-            protocol = config.get(endpoint, 'protocol')
+            protocol = section.get('protocol')
 
         if port is None:
-            port = config.get(endpoint, 'port')
+            port = section.get('port')
 
         if url is None:
-            url = config.get(endpoint, 'url')
+            url = section.get('url')
+
+        if version is None:
+            version = section.get('version')
 
         if db is None:
-            db = config.get(endpoint, 'db')
+            db = section.get('db')
         self.db = db
 
         if user is None:
-            user = config.get(endpoint, 'user')
+            user = section.get('user')
         self.user = user
 
         if password is None:
-            password = config.get(endpoint, 'password')
+            password = section.get('password')
         self.password = password
 
-        # First login and keep uid
+        if cache_file is None:
+            cache_file = section.get('cache_file', CACHE_FILE)
+        self.cache_file = cache_file
+        # Same db name on other servers or users (record rules) must not
+        # share persistent entries
+        self._disk_prefix = '{0}:{1}:{2}:{3}'.format(url, port, db, user)
+
+        # Login is done on first call, giving the server version avoid
+        # odoorpc to ask for it. Connections are kept alive between calls.
         self.logger.debug('Attempting to connect to {0} using {1}'.format(
             url,
             protocol))
-        self.client = odoorpc.ODOO(url, port=port, protocol=protocol)
+        self.client = odoorpc.ODOO(url, port=port, protocol=protocol,
+                                   version=version, opener=build_opener())
         self.initialized = False
+        self._env_cache = {}
 
         # Create cache for product and taxes
-        self.products_cache = {}
-        self.taxes_cache = {}
+        self.products_cache = LRUCache(maxsize=cache_size,
+                                       name='product.product')
+        self.taxes_cache = LRUCache(maxsize=cache_size, name='account.tax')
+        self._revision = None
+        self._revision_fetched_at = None
+        self._executor = None
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._disk_cache = None
+        self._disk_lock = threading.Lock()
+
+    def cache_info(self):
+        """Return hits / misses statistics of products and taxes caches."""
+        return {'products': self.products_cache.cache_info(),
+                'taxes': self.taxes_cache.cache_info()}
+
+    def _cache_revision(self):
+        """Return cache revision stored in odoo, refreshed every
+        CACHE_REVISION_TTL seconds
+        """
+        now = time.time()
+        if self._revision_fetched_at is not None and \
+                now - self._revision_fetched_at < CACHE_REVISION_TTL:
+            return self._revision
+
+        # On any failure (access rights, network, timeout) keep previous
+        # revision so cached entries are still served, and wait for next
+        # refresh before asking again
+        try:
+            self._revision = self.execute('ir.config_parameter',
+                                          'get_param',
+                                          CACHE_REVISION_PARAM)
+        except Exception as e:
+            self.logger.warning('Unable to fetch cache revision: ' +
+                                '{0}'.format(e))
+        self._revision_fetched_at = now
+        return self._revision
+
+    def _cache_get(self, cache, key, loader=None):
+        """Return cached value if it matches current revision, else None.
+
+        If value is older than CACHE_SOFT_TTL and a loader is given, value
+        is still returned but refreshed in background.
+        """
+        entry = cache.get(key)
+        if entry is None:
+            entry = self._disk_get(cache, key)
+            if entry is None:
+                return None
+            cache[key] = entry
+
+        revision, value, fetched_at = entry
+        if revision != self._cache_revision():
+            cache.pop(key)
+            return None
+
+        age = time.time() - fetched_at
+        if age > CACHE_HARD_TTL:
+            cache.pop(key)
+            return None
+        elif age > CACHE_SOFT_TTL and loader is not None:
+            self._refresh_async(cache, key, loader)
+        return value
+
+    def _cache_set(self, cache, key, value):
+        """Store value in cache with current revision."""
+        entry = (self._cache_revision(), value, time.time())
+        cache[key] = entry
+        self._disk_set(cache, key, entry)
+
+    def _open_disk_cache(self):
+        """Open persistent cache, must be called with _disk_lock held.
+
+        Entries are stored as JSON, never pickled. Return None if disabled
+        or unavailable.
+        """
+        if self._disk_cache is None and self.cache_file:
+            try:
+                directory = os.path.dirname(self.cache_file)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory, 0o700)
+                self._disk_cache = dbm.open(self.cache_file, 'c', 0o600)
+            except Exception as e:
+                self.logger.warning('Unable to open cache file ' +
+                                    '{0}: {1}'.format(self.cache_file, e))
+                self.cache_file = None
+        return self._disk_cache
+
+    def close(self):
+        """Wait for background refresh and close persistent cache."""
+        with self._inflight_lock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+        with self._disk_lock:
+            if self._disk_cache is not None:
+                self._disk_cache.close()
+                self._disk_cache = None
+
+    def _disk_key(self, cache, key):
+        """Return persistent cache key for key in cache."""
+        return '{0}:{1}:{2}'.format(self._disk_prefix, cache.name, key)
+
+    def _disk_get(self, cache, key):
+        """Return entry stored on disk, None if missing."""
+        with self._disk_lock:
+            disk_cache = self._open_disk_cache()
+            if disk_cache is None:
+                return None
+            try:
+                data = disk_cache.get(self._disk_key(cache, key))
+                if data is None:
+                    return None
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                revision, value, fetched_at = json.loads(data)
+                return (revision, Record(value), fetched_at)
+            except Exception as e:
+                self.logger.warning('Unable to load cache for ' +
+                                    '{0}: {1}'.format(key, e))
+                return None
+
+    def _disk_set(self, cache, key, entry):
+        """Store entry on disk."""
+        with self._disk_lock:
+            disk_cache = self._open_disk_cache()
+            if disk_cache is None:
+                return
+            try:
+                disk_cache[self._disk_key(cache, key)] = json.dumps(entry)
+                sync = getattr(disk_cache, 'sync', None)
+                if sync is not None:
+                    sync()
+            except Exception as e:
+                self.logger.warning('Unable to store cache for ' +
+                                    '{0}: {1}'.format(key, e))
+
+    def _cached_fetch(self, cache, key, loader):
+        """Return cached value for key, use loader(key) on miss."""
+        value = self._cache_get(cache, key, loader)
+        if value is not None:
+            return value
+
+        future, owner = self._start_load(cache, key)
+        if owner:
+            self._run_load(cache, key, loader, future)
+        return future.result()
+
+    def _start_load(self, cache, key):
+        """Register a load of key in cache, concurrent loads share the same
+        future. Return (future, owner), owner must run the load.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get((id(cache), key))
+            if future is not None:
+                return future, False
+
+            future = Future()
+            self._inflight[(id(cache), key)] = future
+            return future, True
+
+    def _run_load(self, cache, key, loader, future):
+        """Call loader(key), store result in cache and resolve future."""
+        try:
+            value = loader(key)
+            if value is not None:
+                self._cache_set(cache, key, value)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(value)
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop((id(cache), key), None)
+
+    def _refresh_async(self, cache, key, loader):
+        """Refresh a cache entry in a background thread."""
+        future, owner = self._start_load(cache, key)
+        if not owner:
+            return
+
+        with self._inflight_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2)
+            executor = self._executor
+
+        try:
+            executor.submit(self._refresh, cache, key, loader, future)
+        except Exception as e:
+            # Executor shut down by close(), waiters must not hang
+            future.set_exception(e)
+            with self._inflight_lock:
+                self._inflight.pop((id(cache), key), None)
+
+    def _refresh(self, cache, key, loader, future):
+        """Reload a cache entry, keep the old one if odoo fails."""
+        self._run_load(cache, key, loader, future)
+        if future.exception() is not None:
+            self.logger.warning('Unable to refresh cache for ' +
+                                '{0}: {1}'.format(key, future.exception()))
 
     def login(self):
         """Login."""
         self.client.login(self.db, self.user, self.password)
         self.initialized = True
 
+    def _debug_enabled(self):
+        """Return False when logger would drop debug messages."""
+        logger = self.logger
+        if not hasattr(logger, 'isEnabledFor'):
+            # alkivi.logger.Logger wraps a standard logger
+            logger = getattr(logger, 'logger', None)
+        if not hasattr(logger, 'isEnabledFor'):
+            return True
+        return logger.isEnabledFor(logging.DEBUG)
+
+    def _env(self, model):
+        """Return odoorpc model class, cached per model."""
+        env = self._env_cache.get(model)
+        if env is None:
+            env = self.client.env[model]
+            self._env_cache[model] = env
+        return env
+
     def execute(self, *args, **kwargs):
         """Wrapper for clientlib call."""
         if not self.initialized:
             self.login()
         return self.client.execute(*args, **kwargs)
 
+    def execute_kw(self, *args, **kwargs):
+        """Wrapper for clientlib call."""
+        if not self.initialized:
+            self.login()
+        return self.client.execute_kw(*args, **kwargs)
+
     def get(self, model):
         """Wrapper for clientlib call."""
         if not self.initialized:
             self.login()
-        return self.client.env[model]
+        return self._env(model)
 
     def read(self, *args, **kwargs):
         """Wrapper for clientlib call."""
@@ -100,30 +391,57 @@ class Client(object):
             self.login()
         return self.client.read(*args, **kwargs)
 
-    def search(self, model, data):
+    def search(self, model, data, limit=None):
         """Wrapper for clientlib call."""
         if not self.initialized:
             self.login()
 
-        env = self.client.env[model]
-        return env.search(data)
+        env = self._env(model)
+        if limit is None:
+            return env.search(data)
+        return env.search(data, limit=limit)
 
     def create(self, model, data):
         """Wrapper for clientlib call."""
         if not self.initialized:
             self.login()
 
-        env = self.client.env[model]
+        env = self._env(model)
         return env.create(data)
 
+    def write(self, model, ids, data):
+        """Wrapper for clientlib call."""
+        if not self.initialized:
+            self.login()
+
+        env = self._env(model)
+        return env.write(ids, data)
+
     def browse(self, model, ids):
         """Wrapper for clientlib call."""
         if not self.initialized:
             self.login()
 
-        env = self.client.env[model]
+        env = self._env(model)
         return env.browse(ids)
 
+    def _read(self, model, ids, fields):
+        """Read fields of several records in one call, return a list of
+        Record.
+        """
+        rows = self.execute_kw(model, 'read', [ids], {'fields': fields})
+        return [Record(row) for row in rows]
+
+    def _search_read(self, model, domain, fields, limit=2, order=None):
+        """Search and read records in one call, return a list of Record."""
+        kwargs = {'fields': fields}
+        if limit is not None:
+            kwargs['limit'] = limit
+        if order is not None:
+            kwargs['order'] = order
+        rows = self.execute_kw(model, 'search_read', [domain], kwargs)
+        return [Record(row) for row in rows]
+
     def exec_workflow(self, model, signal, record_id):
         """Wrapper for clientlib call."""
         if not self.initialized:
@@ -205,14 +523,31 @@ class Client(object):
 
         Fetch product with name Produits et Services %s (20 19,6 ...)
         """
+        return self._cached_fetch(self.products_cache, vat_index,
+                                  self._fetch_product)
 
-        # Do we have cache ?
-        if vat_index in self.products_cache:
-            return self.products_cache[vat_index]
+    def _fetch_product(self, vat_index):
+        """Fetch product object in openerp, without cache."""
 
         # Fetch associated tax
         tax = self.fetch_tax(vat_index)
+        description = self._product_description(tax)
+
+        search_args = [('name_template', 'ilike', description)]
+        products = self._search_read('product.product', search_args,
+                                     PRODUCT_FIELDS)
+
+        if not products:
+            raise Exception('%s is missing in product.product' % description)
+        elif len(products) > 1:
+            self.logger.warning('Got several ids',
+                                [product.id for product in products])
+            raise Exception('More than one product %s' % description)
 
+        return products[0]
+
+    def _product_description(self, tax):
+        """Return the product name associated to a tax, None mean no tax."""
         if tax is None:
             text = '0'
         else:
@@ -223,24 +558,85 @@ class Client(object):
                 text = '%2.1f' % text
 
         description = 'Produits et Services %s' % text
-        description = ','.join(re.split('\.', description))
+        return description.replace('.', ',')
 
-        search_args = [('name_template', 'ilike', description)]
-        product_ids = self.search('product.product', search_args)
+    def prefetch_products(self, vat_indices):
+        """Fetch products for several vat_index in one call and store them
+        into cash
 
-        if not product_ids:
-            raise Exception('%s is missing in product.product' % description)
-        elif len(product_ids) > 1:
-            self.logger.warning('Got several ids', product_ids)
-            raise Exception('More than one product %s' % description)
-
-        product_id = product_ids[0]
-        product = self.browse('product.product', product_id)
-
-        # Update cache
-        self.products_cache[vat_index] = product
-
-        return product
+        Products that are missing or ambiguous are left to fetch_product
+        """
+        vat_indices = set(vat_indices)
+        self.prefetch_taxes(vat_indices)
+
+        wanted = {}
+        for vat_index in vat_indices:
+            if self._cache_get(self.products_cache, vat_index) is not None:
+                continue
+
+            # Taxes that are missing or ambiguous are reported by
+            # fetch_product
+            if vat_index == 'default':
+                try:
+                    tax = self.fetch_tax(vat_index)
+                except Exception:
+                    continue
+            elif float(vat_index) == float(0):
+                tax = None
+            else:
+                tax = self._cache_get(self.taxes_cache, vat_index)
+                if tax is None:
+                    continue
+            wanted[vat_index] = self._product_description(tax)
+
+        if not wanted:
+            return
+
+        search_args = ['|'] * (len(wanted) - 1)
+        for description in wanted.values():
+            search_args.append(('name_template', 'ilike', description))
+        products = self._search_read('product.product', search_args,
+                                     PRODUCT_FIELDS, limit=None)
+
+        for vat_index, description in wanted.items():
+            matches = [product for product in products
+                       if description.lower() in
+                       (product.name_template or '').lower()]
+            if len(matches) == 1:
+                self._cache_set(self.products_cache, vat_index, matches[0])
+
+    def prefetch_taxes(self, vat_indices):
+        """Fetch taxes for several vat_index in one call and store them
+        into cash
+
+        Only ACH-xx taxes are prefetched, default and missing or ambiguous
+        taxes are left to fetch_tax
+        """
+        wanted = {}
+        for vat_index in set(vat_indices):
+            if vat_index == 'default':
+                continue
+            elif self._cache_get(self.taxes_cache, vat_index) is not None:
+                continue
+            elif float(vat_index) == float(0):
+                continue
+            wanted['ACH-%s' % vat_index] = vat_index
+
+        if not wanted:
+            return
+
+        search_args = [('description', 'in', list(wanted))]
+        taxes = self._search_read('account.tax', search_args, TAX_FIELDS,
+                                  limit=None)
+
+        found = {}
+        for tax in taxes:
+            found.setdefault(tax.description, []).append(tax)
+
+        for description, vat_index in wanted.items():
+            matches = found.get(description, [])
+            if len(matches) == 1:
+                self._cache_set(self.taxes_cache, vat_index, matches[0])
 
     def fetch_tax(self, vat_index):
         """Fetch tax object in openerp and store into cash to avoid repetition
@@ -249,14 +645,13 @@ class Client(object):
         other tax 19.6, 20, are fetch using ACH-20 ...
         0 mean no tax so return None
         """
+        return self._cached_fetch(self.taxes_cache, vat_index,
+                                  self._fetch_tax)
 
-        # Do we have cache ?
-        if vat_index in self.taxes_cache:
-            return self.taxes_cache[vat_index]
+    def _fetch_tax(self, vat_index):
+        """Fetch tax object in openerp, without cache."""
 
         # Fetch default value in openerp
-        tax_id = None
-
         if vat_index == 'default':
             tax_ids = self.execute('ir.values',
                                    'get_default',
@@ -266,27 +661,25 @@ class Client(object):
                                    1,
                                    False)
             tax_id = tax_ids[0]
+
+            # Check that configuration is correct
+            if tax_id is None:
+                raise Exception('We should have tax_id here')
+
+            tax = self._read('account.tax', [tax_id], TAX_FIELDS)[0]
         elif float(vat_index) == float(0):
             return None
         else:
             search_args = [('description', '=', 'ACH-%s' % vat_index)]
-            tax_ids = self.search('account.tax', search_args)
-            if not tax_ids:
+            taxes = self._search_read('account.tax', search_args, TAX_FIELDS)
+            if not taxes:
                 raise Exception('tax %s is missing in account.tax' % vat_index)
-            elif len(tax_ids) > 1:
-                self.logger.warning('Got several ids', tax_ids)
+            elif len(taxes) > 1:
+                self.logger.warning('Got several ids',
+                                    [tax.id for tax in taxes])
                 raise Exception('More than one tax with description ' +
                                 '{0}'.format(vat_index))
-            tax_id = tax_ids[0]
-
-        # Check that configuration is correct
-        if tax_id is None:
-            raise Exception('We should have tax_id here')
-
-        tax = self.browse('account.tax', tax_id)
-
-        # Update cache
-        self.taxes_cache[vat_index] = tax
+            tax = taxes[0]
 
         return tax
 
@@ -296,15 +689,16 @@ class Client(object):
         """
 
         search_args = [('code', '=', code)]
-        account_ids = self.search('account.account', search_args)
+        accounts = self._search_read('account.account', search_args,
+                                     ACCOUNT_FIELDS)
 
-        if not account_ids:
+        if not accounts:
             raise Exception('Account %s not found' % code)
-        elif len(account_ids) > 1:
+        elif len(accounts) > 1:
             raise Exception('Found multiple accounts with code' +
                             '{0}'.format(code))
 
-        return self.browse('account.account', account_ids[0])
+        return accounts[0]
 
     def fetch_partner(self, name, customer=False, supplier=False):
         """Return openerp res.partner using name to search it
@@ -312,7 +706,8 @@ class Client(object):
         First try exact name, if no match then like
         """
 
-        search_args = [('name', '=', name)]
+        # Exact and like match are fetched at once, exact is preferred
+        search_args = ['|', ('name', '=', name), ('name', 'ilike', name)]
 
         if customer:
             search_args.append(('customer', '=', 1))
@@ -320,11 +715,18 @@ class Client(object):
         if supplier:
             search_args.append(('supplier', '=', 1))
 
-        customer_ids = self.search('res.partner', search_args)
+        customers = self._search_read('res.partner', search_args,
+                                      ['id', 'name'],
+                                      limit=PARTNER_SEARCH_LIMIT,
+                                      order='name asc')
+        customer_ids = [customer.id for customer in customers
+                        if customer.name == name]
+        if not customer_ids and len(customers) == PARTNER_SEARCH_LIMIT:
+            # Exact match might be past the limit
+            search_args[0:3] = [('name', '=', name)]
+            customer_ids = self.search('res.partner', search_args, limit=2)
         if not customer_ids:
-            search_args.pop(0)
-            search_args.append(('name', 'ilike', name))
-            customer_ids = self.search('res.partner', search_args)
+            customer_ids = [customer.id for customer in customers]
 
         if not customer_ids:
             raise Exception('Supplier %s not found' % name)
@@ -364,17 +766,19 @@ class Client(object):
         if state not in ('draft', 'open'):
             raise Exception('State %s is not valid' % state)
 
-        # Create invoice
-        self.logger.debug('going to create invoice with', invoice_data)
-        invoice_id = self.create('account.invoice', invoice_data)
-        self.logger.debug('created invoice %d' % invoice_id)
+        # Avoid formatting big dicts when debug is disabled
+        debug = self._debug_enabled()
 
-        # Create invoice_line
-        for line_data in lines_data:
-            line_data['invoice_id'] = invoice_id
-            self.logger.debug('going to create invoice_line with', line_data)
-            invoice_line_id = self.create('account.invoice.line', line_data)
-            self.logger.debug('created invoice.line %d' % invoice_line_id)
+        # Create invoice and all invoice_line in one call using one2many
+        # commands, so it happens in a single server transaction
+        data = dict(invoice_data)
+        data['invoice_line'] = [(0, 0, line_data) for line_data in lines_data]
+        if debug:
+            self.logger.debug('going to create invoice with', data)
+        invoice_id = self.create('account.invoice', data)
+        if debug:
+            self.logger.debug('created invoice %d ' % invoice_id +
+                              'with %d invoice.line' % len(lines_data))
 
         # Compute taxes
         result = self.execute('account.invoice',
@@ -384,16 +788,19 @@ class Client(object):
             raise Exception('Unable to compute taxes, WTF')
 
         # If tax_amount, check that taxes match
+        invoice = None
         if tax_amount:
-            invoice = self.browse('account.invoice', invoice_id)
-            tax_lines = invoice.tax_line
+            invoice = self._read('account.invoice', [invoice_id],
+                                 ['tax_line', 'number'])[0]
+            tax_lines = self._read('account.invoice.tax', invoice.tax_line,
+                                   ['tax_code_id', 'amount'])
 
             # Check that we have only one tax line
-            number_of_tax_lines = 0
+            number_of_tax_lines = len(tax_lines)
 
-            for tax_line in tax_lines:
-                number_of_tax_lines += 1
-                self.logger.debug('tax_line data', tax_line._values)
+            if debug:
+                for tax_line in tax_lines:
+                    self.logger.debug('tax_line data', tax_line)
 
             if number_of_tax_lines == 0:
                 raise Exception('No tax yet, we should have')
@@ -403,6 +810,7 @@ class Client(object):
                 # fix amount if necessary
                 should_fix_vat = True
                 vat_data_to_fix = {}
+                vat_amounts = []
                 for line_data in lines_data:
                     if 'vat_amount' not in line_data:
                         should_fix_vat = False
@@ -421,22 +829,32 @@ class Client(object):
                                           t3)
                             should_fix_vat = False
                             break
-                        tax_id = t3[0]
-                        # With this tax_id, fetch the tax_code_id
-                        tax = self.browse('account.tax', tax_id)
-                        if not tax:
+                        vat_amounts.append((t3[0], line_data['vat_amount']))
+
+                if should_fix_vat:
+                    # With all tax_id, fetch the tax_code_id in one call
+                    tax_ids = list(set(tax_id for tax_id, _ in vat_amounts))
+                    taxes = self._read('account.tax', tax_ids,
+                                       ['tax_code_id'])
+                    tax_codes = dict((tax.id, tax.tax_code_id)
+                                     for tax in taxes)
+                    for tax_id, vat_amount in vat_amounts:
+                        tax_code = tax_codes.get(tax_id)
+                        if not tax_code:
                             self.logger.warning('Unable to fetch account.tax ' +
                                             '{0}'.format(tax_id))
                             should_fix_vat = False
                             break
-                        tax_code = tax.tax_code_id
-                        vat_data_to_fix[tax_code.id] = line_data['vat_amount']
+                        vat_data_to_fix[tax_code[0]] = vat_amount
 
                 if should_fix_vat:
-                    self.logger.debug('Checking vat with', vat_data_to_fix)
+                    if debug:
+                        self.logger.debug('Checking vat with',
+                                          vat_data_to_fix)
                     all_is_correct = True
-                    for tax_line in invoice.tax_line:
-                        tax_code_id = tax_line.tax_code_id.id
+                    for tax_line in tax_lines:
+                        tax_code_id = tax_line.tax_code_id and \
+                            tax_line.tax_code_id[0]
                         if tax_code_id not in vat_data_to_fix:
                             self.logger.warning('Trying to fix tax not OK ????',
                                             tax_code_id,
@@ -444,8 +862,10 @@ class Client(object):
                             all_is_correct = False
                             break
                     if all_is_correct:
-                        for tax_line in invoice.tax_line:
-                            tax_code_id = tax_line.tax_code_id.id
+                        # Group tax_line by amount to write them at once
+                        fixups = {}
+                        for tax_line in tax_lines:
+                            tax_code_id = tax_line.tax_code_id[0]
                             correct_amount = vat_data_to_fix[tax_code_id]
                             if tax_line.amount != correct_amount:
                                 message = 'Fix tax_line amount ' +\
@@ -457,7 +877,11 @@ class Client(object):
                                     self.logger.warning(message)
                                 else:
                                     self.logger.info(message)
-                                tax_line.amount = correct_amount
+                                fixups.setdefault(correct_amount,
+                                                  []).append(tax_line.id)
+                        for correct_amount, ids in fixups.items():
+                            self.write('account.invoice.tax', ids,
+                                       {'amount': correct_amount})
 
                 else:
                     self.logger.info('We have multiple lines with tax, ' +
@@ -467,6 +891,7 @@ class Client(object):
                         state = 'draft'
             else:
                 # Fix amount, might be wrong usually one cents wrong
+                tax_line = tax_lines[0]
                 if tax_line.amount != tax_amount:
                     message = 'Fix tax_line amount ' +\
                               'from {0} '.format(tax_line.amount) +\
@@ -479,24 +904,30 @@ class Client(object):
                         self.logger.info(message)
 
                     # Update invoice : need to check parameters
-                    tax_line.amount = tax_amount
+                    self.write('account.invoice.tax', [tax_line.id],
+                               {'amount': tax_amount})
                     self.logger.info('tax_line updated')
 
         if state == 'open':
             self.logger.debug('going to execute workflow invoice_open')
             self.exec_workflow('account.invoice', 'invoice_open', invoice_id)
+            # Number is set when opening invoice
+            invoice = None
 
         if attachment_data:
             self.logger.debug('going to attach some data to invoice')
 
-            invoice = self.browse('account.invoice', invoice_id)
-            attachment_data['res_id'] = invoice.id
+            if invoice is None:
+                invoice = self._read('account.invoice', [invoice_id],
+                                     ['number'])[0]
+            attachment_data['res_id'] = invoice_id
             if invoice.number:
                 attachment_data['res_name'] = invoice.number
 
             attachment_id = self.create('ir.attachment', attachment_data)
-            self.logger.debug('attached file ' +
-                              '{0}'.format(attachment_data['name']) +
-                              ' to invoice, id={0}'.format(attachment_id))
+            if debug:
+                self.logger.debug('attached file ' +
+                                  '{0}'.format(attachment_data['name']) +
+                                  ' to invoice, id={0}'.format(attachment_id))
 
         return invoice_id
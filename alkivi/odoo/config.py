@@ -79,6 +79,18 @@ class ConfigurationManager(object):
         # not found, sorry
         return None
 
+    def items(self, section):
+        '''
+        Load all parameters of ``section`` at once, as a dict. Missing
+        section gives an empty dict.
+
+        :param str section: configuration section or region name
+        '''
+        try:
+            return dict(self.config.items(section))
+        except NoSectionError:
+            return {}
+
     def read(self, config_file):
         # Read an other config file
         self.config.read(config_file)
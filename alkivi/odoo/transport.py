@@ -0,0 +1,263 @@
+# -*- encoding: utf-8 -*-
+
+"""
+urllib opener that keeps HTTP connections alive between odoo calls
+
+odoorpc uses urllib which opens a new TCP (and TLS) connection for each
+request. The handlers below keep idle connections per host and reuse them,
+so consecutive RPC only pay the handshake once.
+
+.. code:: python
+
+    odoorpc.ODOO(url, port=443, protocol='jsonrpc+ssl',
+                 opener=build_opener())
+"""
+
+import errno
+import select
+import socket
+import threading
+
+try:
+    from urllib2 import HTTPHandler, HTTPSHandler, HTTPCookieProcessor
+    from urllib2 import URLError
+    from urllib2 import build_opener as _build_opener
+    from urllib import addinfourl
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from cookielib import CookieJar
+    RemoteDisconnected = None
+except ImportError:  # pragma: no cover
+    # Python 3
+    from urllib.request import HTTPHandler, HTTPSHandler, HTTPCookieProcessor
+    from urllib.request import build_opener as _build_opener
+    from urllib.error import URLError
+    from urllib.response import addinfourl
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from http.cookiejar import CookieJar
+    try:
+        from http.client import RemoteDisconnected
+    except ImportError:  # pragma: no cover
+        # Python < 3.5
+        RemoteDisconnected = None
+
+__all__ = ['build_opener', 'KeepAliveHTTPHandler', 'KeepAliveHTTPSHandler']
+
+#: Maximum number of idle connections kept per host
+POOL_MAXSIZE = 4
+
+
+def _closed_by_peer(error):
+    '''
+    Return True if ``error`` means the peer closed the connection before
+    the request was sent, so it is safe to send it again. Timeouts are never
+    safe: the server might be processing the request.
+    '''
+    if isinstance(error, socket.timeout):
+        return False
+    if RemoteDisconnected is not None and \
+            isinstance(error, RemoteDisconnected):
+        return True
+    return getattr(error, 'errno', None) in (errno.EPIPE, errno.ECONNRESET)
+
+
+def _is_complete(response):
+    '''
+    Return True if ``response`` has been read up to its end, so its
+    connection can carry another request. A response closed before that
+    leaves unread data on the connection.
+    '''
+    if not response.isclosed():
+        return False
+    if response.chunked:
+        return response.chunk_left is None
+    return not response.length
+
+
+def _is_dropped(conn):
+    '''
+    Return True if an idle connection has been closed by the server: an
+    idle socket is only readable once the peer closed it.
+    '''
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([conn.sock], [], [], 0)
+    except (socket.error, ValueError):
+        return True
+    return bool(readable)
+
+
+def _discard(conn, response):
+    '''
+    Close a connection removed from the pool.
+    '''
+    if response.isclosed():
+        conn.close()
+    elif conn.sock is not None:
+        # Closing the connection would close the response someone may
+        # still be reading, the socket is released with the response
+        conn.sock.close()
+        conn.sock = None
+
+
+class KeepAliveMixin(object):
+    '''
+    Keep idle connections per host and reuse them for next requests
+    '''
+    def _init_pool(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get_connection(self, key):
+        '''
+        Return an idle connection for ``key`` whose last response has been
+        fully read, None if there is none. Connections that can't be used
+        anymore are closed.
+        '''
+        with self._lock:
+            idle = self._idle.get(key, [])
+            for conn, response in list(idle):
+                if not response.isclosed():
+                    # Still being read
+                    continue
+                idle.remove((conn, response))
+                if not _is_complete(response) or _is_dropped(conn):
+                    conn.close()
+                    continue
+                return conn
+        return None
+
+    def _release_connection(self, key, conn, response):
+        '''
+        Put a connection back in the pool once its response is received.
+        '''
+        if response.will_close:
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            idle.append((conn, response))
+            for old_conn, old_response in idle[:-POOL_MAXSIZE]:
+                _discard(old_conn, old_response)
+            del idle[:-POOL_MAXSIZE]
+
+    def _headers(self, req):
+        '''
+        Return request headers and proxy tunnel headers, like do_open.
+        '''
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers['Connection'] = 'keep-alive'
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        tunnel_headers = {}
+        proxy_auth_hdr = 'Proxy-Authorization'
+        if proxy_auth_hdr in headers:
+            tunnel_headers[proxy_auth_hdr] = headers.pop(proxy_auth_hdr)
+        return headers, tunnel_headers
+
+    def _send(self, conn, req, headers):
+        '''
+        Send ``req`` on ``conn``, the response is not read.
+        '''
+        try:
+            selector = req.selector
+        except AttributeError:  # pragma: no cover
+            # Python 2
+            selector = req.get_selector()
+
+        conn.request(req.get_method(), selector, req.data, headers)
+
+    def _keepalive_open(self, conn_class, req, **kwargs):
+        '''
+        Open ``req`` reusing an idle connection when possible.
+
+        The request is only sent again on a new connection when the idle one
+        was closed by the server before the request was sent. Errors are
+        raised as URLError like urllib does.
+        '''
+        try:
+            host = req.host
+        except AttributeError:  # pragma: no cover
+            # Python 2
+            host = req.get_host()
+
+        tunnel_host = getattr(req, '_tunnel_host', None)
+        key = (host, tunnel_host)
+        headers, tunnel_headers = self._headers(req)
+
+        conn = self._get_connection(key)
+        if conn is not None:
+            # Each request has its own timeout
+            timeout = req.timeout
+            if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+                timeout = socket.getdefaulttimeout()
+            conn.timeout = timeout
+            conn.sock.settimeout(timeout)
+            try:
+                self._send(conn, req, headers)
+            except (socket.error, HTTPException) as e:
+                conn.close()
+                if not _closed_by_peer(e):
+                    raise URLError(e)
+                conn = None
+
+        if conn is None:
+            conn = conn_class(host, timeout=req.timeout, **kwargs)
+            conn.set_debuglevel(self._debuglevel)
+            if tunnel_host:
+                conn.set_tunnel(tunnel_host, headers=tunnel_headers)
+            try:
+                self._send(conn, req, headers)
+            except (socket.error, HTTPException) as e:
+                conn.close()
+                raise URLError(e)
+
+        try:
+            response = conn.getresponse()
+        except (socket.error, HTTPException) as e:
+            conn.close()
+            raise URLError(e)
+
+        self._release_connection(key, conn, response)
+
+        result = addinfourl(response, response.msg, req.get_full_url(),
+                            response.status)
+        result.msg = response.reason
+        return result
+
+
+class KeepAliveHTTPHandler(KeepAliveMixin, HTTPHandler):
+    '''
+    HTTP handler reusing connections
+    '''
+    def __init__(self, debuglevel=0):
+        HTTPHandler.__init__(self, debuglevel)
+        self._init_pool()
+
+    def http_open(self, req):
+        return self._keepalive_open(HTTPConnection, req)
+
+
+class KeepAliveHTTPSHandler(KeepAliveMixin, HTTPSHandler):
+    '''
+    HTTPS handler reusing connections, and so TLS sessions
+    '''
+    def __init__(self, context=None):
+        HTTPSHandler.__init__(self, context=context)
+        self._init_pool()
+
+    def https_open(self, req):
+        return self._keepalive_open(HTTPSConnection, req,
+                                    context=self._context)
+
+
+def build_opener():
+    '''
+    Return an opener with cookies support, like odoorpc default one, using
+    keep-alive handlers.
+    '''
+    return _build_opener(HTTPCookieProcessor(CookieJar()),
+                         KeepAliveHTTPHandler(),
+                         KeepAliveHTTPSHandler())
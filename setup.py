@@ -23,7 +23,7 @@ setup(
     # Versions should comply with PEP440.  For a discussion on single-sourcing
     # the version across setup.py and the project code, see
     # https://packaging.python.org/en/latest/single_source_version.html
-    version='1.0.3',
+    version='2.0.0',
 
     description='Odoo python client used at Alkivi',
     long_description=long_description,
@@ -82,8 +82,9 @@ setup(
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
-        'odoorpc',
+        'odoorpc>=0.6',
         'alkivi-logger',
+        'futures; python_version < "3"',
     ],
 
     # List additional groups of dependencies here (e.g. development
@@ -0,0 +1,64 @@
+from alkivi.odoo.cache import LRUCache
+
+
+def test_get_and_set():
+    cache = LRUCache(maxsize=2)
+    cache['20'] = 'tax20'
+    assert cache.get('20') == 'tax20'
+    assert cache.get('10') is None
+    assert cache.get('10', 'default') == 'default'
+    assert '20' in cache
+    assert len(cache) == 1
+
+
+def test_least_recently_used_is_evicted():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    # Use a, b is now the least recently used
+    cache.get('a')
+    cache['c'] = 3
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert len(cache) == 2
+
+
+def test_setting_existing_key_refreshes_it():
+    cache = LRUCache(maxsize=2)
+    cache['a'] = 1
+    cache['b'] = 2
+    cache['a'] = 3
+    cache['c'] = 4
+    assert cache['a'] == 3
+    assert 'b' not in cache
+
+
+def test_cache_info():
+    cache = LRUCache(maxsize=3)
+    cache['a'] = 1
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    # Membership tests are not counted
+    'a' in cache
+    info = cache.cache_info()
+    assert info.hits == 2
+    assert info.misses == 1
+    assert info.maxsize == 3
+    assert info.currsize == 1
+
+
+def test_pop_and_clear():
+    cache = LRUCache()
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    del cache['b']
+    assert len(cache) == 0
+    cache['c'] = 3
+    cache.get('c')
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.cache_info().hits == 1
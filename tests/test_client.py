@@ -0,0 +1,322 @@
+import logging
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('odoorpc')
+
+from alkivi.odoo import client as client_module  # noqa
+from alkivi.odoo.client import Client  # noqa
+
+
+@pytest.fixture
+def client():
+    client = Client(endpoint='test', protocol='jsonrpc', port=8069,
+                    url='localhost', version='8.0', db='odoo', user='user',
+                    password='password', cache_file=False)
+    # No odoo server here
+    client._cache_revision = lambda: None
+    return client
+
+
+def fetch_concurrently(client, loader, count=5):
+    results = []
+    errors = []
+
+    def fetch():
+        try:
+            results.append(client._cached_fetch(client.taxes_cache, '20',
+                                                loader))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=fetch) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_misses_share_one_load(client):
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        time.sleep(0.2)
+        return {'id': 5}
+
+    results, errors = fetch_concurrently(client, loader)
+    assert calls == ['20']
+    assert errors == []
+    assert results == [{'id': 5}] * 5
+    assert client._inflight == {}
+
+    # Next call is served from cache
+    assert client._cached_fetch(client.taxes_cache, '20', loader) == \
+        {'id': 5}
+    assert calls == ['20']
+
+
+def test_concurrent_misses_share_exception(client):
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        time.sleep(0.2)
+        raise Exception('tax %s is missing in account.tax' % key)
+
+    results, errors = fetch_concurrently(client, loader)
+    assert calls == ['20']
+    assert results == []
+    assert len(errors) == 5
+    assert all(str(e) == 'tax 20 is missing in account.tax' for e in errors)
+    assert client._inflight == {}
+    assert '20' not in client.taxes_cache
+
+
+def test_none_is_not_cached(client):
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        return None
+
+    assert client._cached_fetch(client.taxes_cache, '0', loader) is None
+    assert client._cached_fetch(client.taxes_cache, '0', loader) is None
+    assert calls == ['0', '0']
+
+
+class WrappingLogger(object):
+    """Like alkivi.logger.Logger: no isEnabledFor, wraps a standard one."""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+
+def test_debug_enabled(client):
+    logger = logging.getLogger('alkivi.odoo.tests')
+    logger.setLevel(logging.INFO)
+    client.logger = logger
+    assert not client._debug_enabled()
+
+    client.logger = WrappingLogger(logger)
+    assert not client._debug_enabled()
+
+    logger.setLevel(logging.DEBUG)
+    assert client._debug_enabled()
+
+    # Unknown logger, keep logging
+    client.logger = object()
+    assert client._debug_enabled()
+
+
+def test_cache_revision_failure_keeps_previous_revision():
+    client = Client(endpoint='test', protocol='jsonrpc', port=8069,
+                    url='localhost', version='8.0', db='odoo', user='user',
+                    password='password', cache_file=False)
+    calls = []
+
+    def execute(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            raise IOError('odoo is down')
+        return '1'
+
+    client.execute = execute
+    assert client._cache_revision() == '1'
+
+    # Revision is outdated, refresh fails
+    client._revision_fetched_at -= 3600
+    assert client._cache_revision() == '1'
+    assert len(calls) == 2
+
+    # No retry before next refresh
+    assert client._cache_revision() == '1'
+    assert len(calls) == 2
+
+
+def age_entry(client, key, age):
+    revision, value, fetched_at = client.taxes_cache[key]
+    client.taxes_cache[key] = (revision, value, fetched_at - age)
+
+
+def test_soft_stale_entry_is_refreshed_in_background(client):
+    values = [{'id': 5}, {'id': 6}]
+    refreshed = threading.Event()
+
+    def loader(key):
+        value = values.pop(0)
+        if not values:
+            refreshed.set()
+        return value
+
+    assert client._cached_fetch(client.taxes_cache, '20', loader) == \
+        {'id': 5}
+    age_entry(client, '20', client_module.CACHE_SOFT_TTL + 1)
+
+    # Old value is returned at once, new one is loaded in background
+    assert client._cached_fetch(client.taxes_cache, '20', loader) == \
+        {'id': 5}
+    assert refreshed.wait(5)
+    client.close()
+    assert client._cached_fetch(client.taxes_cache, '20', loader) == \
+        {'id': 6}
+    assert client._inflight == {}
+
+
+def test_hard_stale_entry_is_reloaded(client):
+    values = [{'id': 5}, {'id': 6}]
+
+    def loader(key):
+        return values.pop(0)
+
+    client._cached_fetch(client.taxes_cache, '20', loader)
+    age_entry(client, '20', client_module.CACHE_HARD_TTL + 1)
+    assert client._cached_fetch(client.taxes_cache, '20', loader) == \
+        {'id': 6}
+    assert values == []
+
+
+def test_failed_refresh_keeps_old_value(client):
+    calls = []
+
+    def loader(key):
+        calls.append(key)
+        if len(calls) > 1:
+            raise Exception('odoo is down')
+        return {'id': 5}
+
+    client._cached_fetch(client.taxes_cache, '20', loader)
+    age_entry(client, '20', client_module.CACHE_SOFT_TTL + 1)
+    assert client._cached_fetch(client.taxes_cache, '20', loader) == \
+        {'id': 5}
+    client.close()
+    assert len(calls) == 2
+    assert client._inflight == {}
+    assert client.taxes_cache['20'][1] == {'id': 5}
+
+
+def test_refresh_after_executor_shutdown(client):
+    def loader(key):
+        return {'id': 5}
+
+    client._cached_fetch(client.taxes_cache, '20', loader)
+    client._executor = client_module.ThreadPoolExecutor(max_workers=1)
+    client._executor.shutdown()
+    client._refresh_async(client.taxes_cache, '20', loader)
+    assert client._inflight == {}
+
+
+def disk_client(tmp_path, revision='1', url='localhost', user='user'):
+    client = Client(endpoint='test', protocol='jsonrpc', port=8069, url=url,
+                    version='8.0', db='odoo', user=user, password='password',
+                    cache_file=str(tmp_path / 'c'))
+    client._cache_revision = lambda: revision
+    return client
+
+
+def tax_loader(calls, tax_id=5):
+    def loader(key):
+        calls.append(key)
+        return client_module.Record({'id': tax_id, 'amount': 0.2})
+    return loader
+
+
+def test_disk_cache_is_shared_between_runs(tmp_path):
+    calls = []
+    first = disk_client(tmp_path)
+    first._cached_fetch(first.taxes_cache, '20', tax_loader(calls))
+    first.close()
+
+    second = disk_client(tmp_path)
+    tax = second._cached_fetch(second.taxes_cache, '20', tax_loader(calls))
+    second.close()
+    assert calls == ['20']
+    assert isinstance(tax, client_module.Record)
+    assert tax.id == 5
+    assert tax.amount == 0.2
+
+
+def test_disk_cache_other_revision_is_ignored(tmp_path):
+    calls = []
+    first = disk_client(tmp_path, revision='1')
+    first._cached_fetch(first.taxes_cache, '20', tax_loader(calls))
+    first.close()
+
+    second = disk_client(tmp_path, revision='2')
+    tax = second._cached_fetch(second.taxes_cache, '20',
+                               tax_loader(calls, tax_id=6))
+    second.close()
+    assert calls == ['20', '20']
+    assert tax.id == 6
+
+
+@pytest.mark.parametrize('other', [{'url': 'other'}, {'user': 'other'}])
+def test_disk_cache_is_not_shared_between_servers_and_users(tmp_path,
+                                                            other):
+    calls = []
+    first = disk_client(tmp_path)
+    first._cached_fetch(first.taxes_cache, '20', tax_loader(calls))
+    first.close()
+
+    second = disk_client(tmp_path, **other)
+    tax = second._cached_fetch(second.taxes_cache, '20',
+                               tax_loader(calls, tax_id=6))
+    second.close()
+    assert calls == ['20', '20']
+    assert tax.id == 6
+
+
+def test_disk_cache_corrupt_value_is_a_miss(tmp_path, caplog):
+    calls = []
+    first = disk_client(tmp_path)
+    first._cached_fetch(first.taxes_cache, '20', tax_loader(calls))
+    with first._disk_lock:
+        disk_cache = first._open_disk_cache()
+        disk_cache[first._disk_key(first.taxes_cache, '20')] = 'not json'
+    first.close()
+
+    second = disk_client(tmp_path)
+    tax = second._cached_fetch(second.taxes_cache, '20', tax_loader(calls))
+    second.close()
+    assert calls == ['20', '20']
+    assert tax.id == 5
+    assert 'Unable to load cache for 20' in caplog.text
+
+
+def test_prefetch_products(client):
+    taxes = [
+        {'id': 1, 'amount': 0.2, 'tax_code_id': [1, 'TVA 20'],
+         'description': 'ACH-20'},
+        {'id': 2, 'amount': 0.055, 'tax_code_id': [2, 'TVA 5,5'],
+         'description': 'ACH-5.5'},
+    ]
+    products = [
+        {'id': 10, 'name_template': 'Produits et Services 20'},
+        {'id': 11, 'name_template': 'Produits et Services 5,5'},
+        {'id': 12, 'name_template': 'Produits et Services 0'},
+    ]
+    calls = []
+
+    def execute_kw(model, method, args, kwargs):
+        calls.append((model, method))
+        if model == 'account.tax':
+            return taxes
+        return products
+
+    client.execute_kw = execute_kw
+    # ACH-10 is missing, it is left to fetch_product
+    client.prefetch_products(['20', '5.5', '10', '0', '20'])
+
+    assert calls == [('account.tax', 'search_read'),
+                     ('product.product', 'search_read')]
+    assert client.fetch_tax('20').id == 1
+    assert client.fetch_tax('5.5').id == 2
+    assert client.fetch_product('20').id == 10
+    assert client.fetch_product('5.5').id == 11
+    assert client.fetch_product('0').id == 12
+    assert len(calls) == 2
+    assert '10' not in client.taxes_cache
+    assert '10' not in client.products_cache
@@ -0,0 +1,140 @@
+import json
+import threading
+import time
+
+import pytest
+
+from alkivi.odoo import transport
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urllib2 import Request, URLError
+except ImportError:
+    # Python 3
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.request import Request
+    from urllib.error import URLError
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Idle connections are closed by the server after this delay
+    timeout = 0.5
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length)
+        self.server.bodies.append(body)
+        self.server.ports.add(self.client_address[1])
+        if body == b'slow':
+            time.sleep(0.5)
+
+        data = json.dumps({'body': body.decode('utf-8'),
+                           'cookie': self.headers.get('Cookie')})
+        data = data.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Set-Cookie', 'session_id=42; Path=/')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.bodies = []
+    server.ports = set()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.url = 'http://127.0.0.1:{0}/jsonrpc'.format(server.server_port)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def post(opener, url, body, timeout=5):
+    request = Request(url, data=body,
+                      headers={'Content-Type': 'application/json'})
+    return opener.open(request, timeout=timeout)
+
+
+def test_connection_is_reused(server):
+    opener = transport.build_opener()
+    for index in range(5):
+        body = '{0}'.format(index).encode('utf-8')
+        response = post(opener, server.url, body)
+        assert response.getcode() == 200
+        assert json.loads(response.read().decode('utf-8'))['body'] == \
+            '{0}'.format(index)
+
+    assert len(server.ports) == 1
+
+
+def test_cookies_are_kept(server):
+    opener = transport.build_opener()
+    post(opener, server.url, b'login').read()
+    response = post(opener, server.url, b'call')
+    assert json.loads(response.read().decode('utf-8'))['cookie'] == \
+        'session_id=42'
+
+
+def test_unread_response_is_not_reused(server):
+    opener = transport.build_opener()
+    unread = post(opener, server.url, b'unread')
+    response = post(opener, server.url, b'next')
+    assert json.loads(response.read().decode('utf-8'))['body'] == 'next'
+    assert len(server.ports) == 2
+    unread.close()
+
+
+def test_closed_response_is_not_reused(server):
+    opener = transport.build_opener()
+    post(opener, server.url, b'closed').close()
+    response = post(opener, server.url, b'next')
+    assert json.loads(response.read().decode('utf-8'))['body'] == 'next'
+    assert server.bodies == [b'closed', b'next']
+
+
+def test_connection_closed_by_server(server):
+    opener = transport.build_opener()
+    post(opener, server.url, b'first').read()
+    time.sleep(1)
+    response = post(opener, server.url, b'second')
+    assert json.loads(response.read().decode('utf-8'))['body'] == 'second'
+    assert server.bodies == [b'first', b'second']
+
+
+def test_timeout_is_not_retried(server):
+    opener = transport.build_opener()
+    post(opener, server.url, b'fast').read()
+    with pytest.raises(URLError):
+        post(opener, server.url, b'slow', timeout=0.2)
+    time.sleep(1)
+    assert server.bodies == [b'fast', b'slow']
+
+
+def test_connection_error_is_url_error():
+    opener = transport.build_opener()
+    with pytest.raises(URLError):
+        post(opener, 'http://127.0.0.1:1/jsonrpc', b'nope')
+
+
+def test_default_timeout(server):
+    opener = transport.build_opener()
+    for body in (b'first', b'second'):
+        request = Request(server.url, data=body)
+        response = opener.open(request)
+        assert json.loads(response.read().decode('utf-8'))['body'] == \
+            body.decode('utf-8')
+    assert len(server.ports) == 1